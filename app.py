@@ -1,24 +1,34 @@
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, Optional, Tuple
+import asyncio
 import os
 import uuid
-import shutil
 from datetime import datetime
 import sqlite3
 from dotenv import load_dotenv
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
-from langchain.schema import Document
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_community.vectorstores import Chroma
+from starlette.concurrency import run_in_threadpool
+from langchain_openai import ChatOpenAI
 from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains.history_aware_retriever import create_history_aware_retriever
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.schema.output_parser import StrOutputParser
 from langchain.schema.runnable import RunnablePassthrough
+from corpus_store import CorpusStore
+from embedding_providers import get_embeddings
+from log_lifecycle import LogLifecycle
+from scheduler import (
+    BULK,
+    INTERACTIVE,
+    ModelCallScheduler,
+    ScheduledEmbeddings,
+    SchedulerOverloaded,
+    retry_after_header,
+    scheduled_runnable,
+)
 
 # Load environment variables
 load_dotenv()
@@ -38,21 +48,47 @@ app.add_middleware(
 UPLOAD_DIR = "docs"
 CHROMA_DIR = "chroma_db"
 DB_NAME = "rag_app.db"
-
-# Ensure directories exist
-os.makedirs(UPLOAD_DIR, exist_ok=True)
-os.makedirs(CHROMA_DIR, exist_ok=True)
+LOG_ARCHIVE_DIR = "log_archive"
+# Sessions idle longer than this move out of application_logs into compressed archives
+LOG_RETENTION_DAYS = float(os.getenv("LOG_RETENTION_DAYS", "30"))
+LOG_MAX_HOT_ROWS = int(os.getenv("LOG_MAX_HOT_ROWS", "100000"))
+LOG_MAINTENANCE_INTERVAL_SECONDS = float(os.getenv("LOG_MAINTENANCE_INTERVAL_SECONDS", "3600"))
+# "openai", "local" (sentence-transformers on CPU) or "hashing" (offline, deterministic)
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")
+# Encode pool size for the local provider; defaults to CPU cores divided by WEB_CONCURRENCY
+EMBEDDING_PROCESSES = int(os.getenv("EMBEDDING_PROCESSES", "0")) or None
+# Model rate limits are for the whole deployment; every worker draws on the buckets in MODEL_RATE_LIMIT_DB
+MODEL_REQUESTS_PER_MINUTE = float(os.getenv("MODEL_REQUESTS_PER_MINUTE", "500"))
+MODEL_TOKENS_PER_MINUTE = float(os.getenv("MODEL_TOKENS_PER_MINUTE", "200000"))
+MODEL_QUEUE_SIZE = int(os.getenv("MODEL_QUEUE_SIZE", "100"))
+MODEL_MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", "3"))
+MODEL_RATE_LIMIT_DB = os.getenv("MODEL_RATE_LIMIT_DB", "model_rate_limits.db")
 
 # Initialize OpenAI and other components
 if not os.getenv("OPENAI_API_KEY"):
     raise ValueError("Please set the OPENAI_API_KEY environment variable")
 
-embeddings = OpenAIEmbeddings()
-llm = ChatOpenAI(model_name="gpt-4o-mini")
+# Every model call goes through one scheduler; it owns retries, so client-side retries are off
+model_scheduler = ModelCallScheduler(
+    requests_per_minute=MODEL_REQUESTS_PER_MINUTE,
+    tokens_per_minute=MODEL_TOKENS_PER_MINUTE,
+    max_queue_size=MODEL_QUEUE_SIZE,
+    max_retries=MODEL_MAX_RETRIES,
+    state_path=MODEL_RATE_LIMIT_DB,
+)
+if EMBEDDING_PROVIDER == "openai":
+    embeddings = ScheduledEmbeddings(get_embeddings("openai", max_retries=0), model_scheduler)
+elif EMBEDDING_PROVIDER == "local":
+    # Local backends have no provider rate limit to protect
+    embeddings = get_embeddings("local", processes=EMBEDDING_PROCESSES)
+else:
+    embeddings = get_embeddings(EMBEDDING_PROVIDER)
+llm = scheduled_runnable(ChatOpenAI(model_name="gpt-4o-mini", max_retries=0), model_scheduler)
 
 # Database functions
 def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+    # Wait out maintenance (archival, VACUUM) rather than failing a turn that is already answered
+    conn = sqlite3.connect(DB_NAME, timeout=30)
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -65,6 +101,8 @@ def create_application_logs():
                     gpt_response TEXT,
                     model TEXT,
                     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_application_logs_session ON application_logs (session_id, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_application_logs_created_at ON application_logs (created_at)')
     conn.close()
 
 def insert_application_logs(session_id, user_query, gpt_response, model):
@@ -75,6 +113,9 @@ def insert_application_logs(session_id, user_query, gpt_response, model):
     conn.close()
 
 def get_chat_history(session_id):
+    # A resumed session may have been archived; bring it back before reading
+    if log_lifecycle.is_archived(session_id):
+        log_lifecycle.restore_session(session_id)
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('SELECT user_query, gpt_response FROM application_logs WHERE session_id = ? ORDER BY created_at', (session_id,))
@@ -87,39 +128,50 @@ def get_chat_history(session_id):
     conn.close()
     return messages
 
-# Initialize database
-create_application_logs()
-
-# Document processing functions
-def load_documents(folder_path: str) -> List[Document]:
-    documents = []
-    for filename in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, filename)
-        if filename.endswith(".pdf"):
-            loader = PyPDFLoader(file_path)
-        elif filename.endswith(".docx"):
-            loader = Docx2txtLoader(file_path)
-        else:
-            continue
-        documents.extend(loader.load())
-    return documents
-
-def process_documents():
-    documents = load_documents(UPLOAD_DIR)
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=2000,
-        chunk_overlap=200,
-        length_function=len
+# Created in the startup hook, not at import: the local embedding pool spawns processes
+# that re-import this module, and they must not touch the database or the corpus lock.
+log_lifecycle: Optional[LogLifecycle] = None
+corpus: Optional[CorpusStore] = None
+
+@app.on_event("startup")
+def startup():
+    global log_lifecycle, corpus
+
+    # Ensure directories exist
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(CHROMA_DIR, exist_ok=True)
+
+    # Initialize database
+    create_application_logs()
+    log_lifecycle = LogLifecycle(
+        DB_NAME,
+        LOG_ARCHIVE_DIR,
+        retention_days=LOG_RETENTION_DAYS,
+        max_hot_rows=LOG_MAX_HOT_ROWS,
+        interval_seconds=LOG_MAINTENANCE_INTERVAL_SECONDS,
     )
-    splits = text_splitter.split_documents(documents)
-    
-    # Create or update vector store
-    vectorstore = Chroma.from_documents(
-        documents=splits,
-        embedding=embeddings,
-        persist_directory=CHROMA_DIR
+
+    # Start any encode pool now, so it is never started while the corpus writer lock is held
+    if hasattr(embeddings, "start_pool"):
+        embeddings.start_pool()
+
+    # Document corpus, shared across worker processes; built from docs/ once, then versioned
+    corpus = CorpusStore(
+        UPLOAD_DIR,
+        CHROMA_DIR,
+        DB_NAME,
+        embeddings,
+        # One collection per provider; their vectors have different dimensions
+        collection_name=f"rag_{EMBEDDING_PROVIDER}",
     )
-    return vectorstore
+    corpus.initialize()
+    log_lifecycle.start()
+
+@app.on_event("shutdown")
+def shutdown():
+    log_lifecycle.stop()
+    if hasattr(embeddings, "close"):
+        embeddings.close()
 
 # Initialize RAG chain
 def create_rag_chain(vectorstore):
@@ -162,6 +214,40 @@ def create_rag_chain(vectorstore):
         question_answer_chain
     )
 
+# Single-flight coalescing of identical first-turn questions
+_inflight_answers: Dict[Tuple[str, int], asyncio.Task] = {}
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+def answer_question(question: str, chat_history: list) -> str:
+    rag_chain = create_rag_chain(corpus.get_vectorstore())
+    response = rag_chain.invoke({
+        "input": question,
+        "chat_history": chat_history
+    })
+    return response['answer']
+
+async def coalesced_answer(question: str) -> str:
+    """Share one retrieval-and-generation run between concurrent callers asking the same
+    question against the same corpus version."""
+    key = (normalize_question(question), corpus.current_version())
+    task = _inflight_answers.get(key)
+    if task is None:
+        task = asyncio.ensure_future(model_scheduler.run_admitted(INTERACTIVE, answer_question, question, []))
+        _inflight_answers[key] = task
+        task.add_done_callback(lambda _: _inflight_answers.pop(key, None))
+    # Shield so one caller disconnecting does not cancel the run for everyone else
+    return await asyncio.shield(task)
+
+@app.exception_handler(SchedulerOverloaded)
+async def scheduler_overloaded_handler(request, exc: SchedulerOverloaded):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc)},
+        headers=retry_after_header(exc),
+    )
+
 # API Models
 class ChatRequest(BaseModel):
     question: str
@@ -177,26 +263,19 @@ async def upload_file(file: UploadFile = File(...)):
     if not file.filename.endswith(('.pdf', '.docx')):
         raise HTTPException(status_code=400, detail="Only PDF and DOCX files are allowed")
     
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    # Process the new document
-    vectorstore = process_documents()
+    # Save and index the new document
+    await model_scheduler.run_admitted(BULK, corpus.add_file, file.filename, file.file)
     
     return {"message": f"File {file.filename} uploaded successfully"}
 
 @app.delete("/documents/{filename}")
 async def delete_file(filename: str):
-    file_path = os.path.join(UPLOAD_DIR, filename)
-    if not os.path.exists(file_path):
+    # Remove the file and its chunks from the index
+    try:
+        await run_in_threadpool(corpus.delete_file, filename)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found")
     
-    os.remove(file_path)
-    
-    # Reprocess documents after deletion
-    vectorstore = process_documents()
-    
     return {"message": f"File {filename} deleted successfully"}
 
 @app.post("/chat", response_model=ChatResponse)
@@ -204,23 +283,18 @@ async def chat(request: ChatRequest):
     if not request.session_id:
         request.session_id = str(uuid.uuid4())
     
-    # Get chat history
-    chat_history = get_chat_history(request.session_id)
+    # Get chat history; restoring an archived session decompresses a file and may wait on the database
+    chat_history = await run_in_threadpool(get_chat_history, request.session_id)
     
-    # Process documents and create RAG chain
-    vectorstore = process_documents()
-    rag_chain = create_rag_chain(vectorstore)
-    
-    # Get response
-    response = rag_chain.invoke({
-        "input": request.question,
-        "chat_history": chat_history
-    })
-    
-    answer = response['answer']
+    # Get response; first-turn questions carry no history, so identical ones can share a run
+    if chat_history:
+        answer = await model_scheduler.run_admitted(INTERACTIVE, answer_question, request.question, chat_history)
+    else:
+        answer = await coalesced_answer(request.question)
     
     # Log the interaction
-    insert_application_logs(
+    await run_in_threadpool(
+        insert_application_logs,
         request.session_id,
         request.question,
         answer,
@@ -242,6 +316,17 @@ async def list_documents():
             })
     return files
 
+@app.post("/sessions/{session_id}/restore")
+async def restore_session(session_id: str):
+    restored = await run_in_threadpool(log_lifecycle.restore_session, session_id)
+    if not restored:
+        raise HTTPException(status_code=404, detail="Archived session not found")
+    return {"message": f"Session {session_id} restored", "turns": restored}
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    return model_scheduler.stats()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,66 @@
+"""Embedding throughput benchmark (chunks/s) for each embedding provider.
+
+Usage:
+    python benchmark_embeddings.py                     # hashing + local
+    python benchmark_embeddings.py --providers openai   # needs OPENAI_API_KEY
+    python benchmark_embeddings.py --docs docs         # real chunks from a folder
+"""
+import argparse
+import os
+import random
+import time
+from typing import List
+
+from dotenv import load_dotenv
+
+from embedding_providers import EMBEDDING_PROVIDERS, get_embeddings
+
+
+def synthetic_chunks(count: int, chunk_size: int) -> List[str]:
+    rng = random.Random(0)
+    vocabulary = [f"word{index}" for index in range(5000)]
+    chunks = []
+    for _ in range(count):
+        words = []
+        target = rng.randint(chunk_size // 2, chunk_size)
+        while sum(len(word) + 1 for word in words) < target:
+            words.append(rng.choice(vocabulary))
+        chunks.append(" ".join(words))
+    return chunks
+
+
+def document_chunks(folder_path: str, chunk_size: int) -> List[str]:
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from corpus_store import load_documents
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=200, length_function=len)
+    return [split.page_content for split in text_splitter.split_documents(load_documents(folder_path))]
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", nargs="+", choices=EMBEDDING_PROVIDERS, default=["hashing", "local"])
+    parser.add_argument("--chunks", type=int, default=2000, help="number of synthetic chunks")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="characters per chunk")
+    parser.add_argument("--docs", help="embed real chunks from this folder instead of synthetic text")
+    args = parser.parse_args()
+
+    chunks = document_chunks(args.docs, args.chunk_size) if args.docs else synthetic_chunks(args.chunks, args.chunk_size)
+    print(f"{len(chunks)} chunks, ~{sum(map(len, chunks)) // max(1, len(chunks))} chars each, {os.cpu_count()} cores")
+
+    for provider in args.providers:
+        embeddings = get_embeddings(provider)
+        if provider != "openai":
+            # Warm up so model loading and encode pool start-up are not counted
+            embeddings.embed_documents(chunks[:512])
+        start = time.perf_counter()
+        vectors = embeddings.embed_documents(chunks)
+        elapsed = time.perf_counter() - start
+        print(f"{provider:>8}: {len(vectors) / elapsed:10.1f} chunks/s ({elapsed:.2f}s, dim={len(vectors[0])})")
+        if hasattr(embeddings, "close"):
+            embeddings.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from chromadb.api.client import SharedSystemClient
+from filelock import FileLock, Timeout
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
+from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx")
+
+
+def load_document(file_path: str) -> List[Document]:
+    if file_path.endswith(".pdf"):
+        loader = PyPDFLoader(file_path)
+    elif file_path.endswith(".docx"):
+        loader = Docx2txtLoader(file_path)
+    else:
+        return []
+    return loader.load()
+
+
+def load_documents(folder_path: str) -> List[Document]:
+    documents = []
+    for filename in sorted(os.listdir(folder_path)):
+        documents.extend(load_document(os.path.join(folder_path, filename)))
+    return documents
+
+
+class CorpusChroma(Chroma):
+    """Chroma that tolerates an index loaded before another worker deleted chunks.
+
+    A reader's in-memory vector index can still return ids whose rows a writer has
+    since removed; Chroma hands those back without a document. They are skipped
+    until the reader reloads at the next version change.
+    """
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict[str, str]] = None,
+                                     where_document: Optional[Dict[str, str]] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        results = self._collection.query(
+            query_embeddings=[self._embedding_function.embed_query(query)],
+            n_results=k,
+            where=filter,
+            where_document=where_document,
+            **kwargs,
+        )
+        return [
+            (Document(page_content=document, metadata=metadata or {}), distance)
+            for document, metadata, distance in zip(
+                results["documents"][0], results["metadatas"][0], results["distances"][0])
+            if document is not None
+        ]
+
+
+class CorpusStore:
+    """Document folder plus Chroma index, shared safely by several worker processes.
+
+    Writes (upload, delete, initial build) take an exclusive file lock, and every
+    committed write bumps a monotonically increasing version in SQLite, kept per
+    collection so each embedding provider's index is versioned on its own. Readers
+    keep their in-memory vector store and reopen it only when that version has moved,
+    so the steady-state cost of a chat request is one small SELECT. Uploads are
+    embedded before the lock is taken, so a failed embedding leaves nothing behind.
+    """
+
+    def __init__(self, upload_dir: str, chroma_dir: str, db_name: str, embeddings: Embeddings,
+                 collection_name: str, chunk_size: int = 2000, chunk_overlap: int = 200):
+        self.upload_dir = upload_dir
+        self.chroma_dir = chroma_dir
+        self.db_name = db_name
+        self.embeddings = embeddings
+        self.collection_name = collection_name
+        self.text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            length_function=len
+        )
+        self.write_lock = FileLock(os.path.join(chroma_dir, ".corpus.lock"))
+        self._vectorstore = None
+        self._loaded_version = None
+        self._local_lock = threading.Lock()
+        self._create_corpus_state()
+
+    # Version bookkeeping
+    def _connect(self):
+        return sqlite3.connect(self.db_name, timeout=30)
+
+    def _create_corpus_state(self):
+        conn = self._connect()
+        # WAL lets every worker read the version while another one writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''CREATE TABLE IF NOT EXISTS corpus_state
+                        (collection_name TEXT PRIMARY KEY,
+                        version INTEGER NOT NULL,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+        conn.commit()
+        conn.close()
+
+    def current_version(self) -> int:
+        conn = self._connect()
+        row = conn.execute('SELECT version FROM corpus_state WHERE collection_name = ?',
+                           (self.collection_name,)).fetchone()
+        conn.close()
+        return row[0] if row else 0
+
+    def _bump_version(self) -> int:
+        conn = self._connect()
+        conn.execute('''INSERT INTO corpus_state (collection_name, version) VALUES (?, 1)
+                        ON CONFLICT(collection_name) DO UPDATE SET version = version + 1,
+                        updated_at = CURRENT_TIMESTAMP''', (self.collection_name,))
+        conn.commit()
+        version = conn.execute('SELECT version FROM corpus_state WHERE collection_name = ?',
+                               (self.collection_name,)).fetchone()[0]
+        conn.close()
+        return version
+
+    # Vector store access
+    def _open_vectorstore(self) -> CorpusChroma:
+        # Chroma caches one client per directory per process, and that client never sees
+        # writes made by other processes; drop it so the index is re-read from disk.
+        SharedSystemClient.clear_system_cache()
+        return CorpusChroma(
+            collection_name=self.collection_name,
+            embedding_function=self.embeddings,
+            persist_directory=self.chroma_dir
+        )
+
+    def _reload(self, version: int):
+        self._vectorstore = self._open_vectorstore()
+        self._loaded_version = version
+
+    def get_vectorstore(self) -> Chroma:
+        """Return this process's vector store, reopening it if another worker changed the corpus."""
+        version = self.current_version()
+        if version == self._loaded_version:
+            return self._vectorstore
+        if self._vectorstore is None:
+            with self._local_lock, self.write_lock:
+                self._reload(self.current_version())
+            return self._vectorstore
+        # Another thread is already reloading; keep serving the current store meanwhile
+        if not self._local_lock.acquire(blocking=False):
+            return self._vectorstore
+        try:
+            # A writer is mid-update; keep serving and pick the new version up on a later request
+            self.write_lock.acquire(timeout=0)
+        except Timeout:
+            self._local_lock.release()
+            return self._vectorstore
+        try:
+            self._reload(self.current_version())
+        finally:
+            self.write_lock.release()
+            self._local_lock.release()
+        return self._vectorstore
+
+    # Writes
+    def _chunk_ids(self, source: str, count: int) -> List[str]:
+        return [hashlib.sha256(f"{source}:{index}".encode("utf-8")).hexdigest() for index in range(count)]
+
+    def _remove_chunks(self, vectorstore: Chroma, source: str):
+        ids = vectorstore.get(where={"source": source})["ids"]
+        if ids:
+            vectorstore.delete(ids=ids)
+
+    def _embed_file(self, load_path: str, source: str) -> Dict[str, list]:
+        """Split and embed a file without touching the index; chunks are attributed to `source`."""
+        splits = self.text_splitter.split_documents(load_document(load_path))
+        for split in splits:
+            split.metadata["source"] = source
+        texts = [split.page_content for split in splits]
+        return {
+            # Deterministic ids make re-indexing a file idempotent
+            "ids": self._chunk_ids(source, len(splits)),
+            "documents": texts,
+            "metadatas": [split.metadata for split in splits],
+            "embeddings": self.embeddings.embed_documents(texts) if texts else [],
+        }
+
+    def _write_chunks(self, vectorstore: Chroma, chunks: Dict[str, list]):
+        if chunks["ids"]:
+            vectorstore._collection.upsert(**chunks)
+
+    def _commit(self, vectorstore: Chroma):
+        self._vectorstore = vectorstore
+        self._loaded_version = self._bump_version()
+
+    def initialize(self):
+        """Build the index from the upload folder once; later workers just load it."""
+        with self.write_lock:
+            version = self.current_version()
+            if version > 0:
+                self._reload(version)
+                return
+            vectorstore = self._open_vectorstore()
+            # Start from an empty collection so chunks from older unversioned builds are not duplicated
+            vectorstore.delete_collection()
+            vectorstore = self._open_vectorstore()
+            for filename in sorted(os.listdir(self.upload_dir)):
+                if filename.endswith(SUPPORTED_EXTENSIONS):
+                    file_path = os.path.join(self.upload_dir, filename)
+                    self._write_chunks(vectorstore, self._embed_file(file_path, file_path))
+            self._commit(vectorstore)
+
+    def add_file(self, filename: str, fileobj: BinaryIO):
+        file_path = os.path.join(self.upload_dir, filename)
+        # Stage on the same filesystem but outside the listing of docs/, keeping the real
+        # extension so the right loader is used
+        staging_dir = os.path.join(self.upload_dir, ".staging")
+        os.makedirs(staging_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=staging_dir, suffix=os.path.splitext(filename)[1])
+        try:
+            with os.fdopen(fd, "wb") as buffer:
+                shutil.copyfileobj(fileobj, buffer)
+            # Embedding is the slow, failure-prone part (rate limits, overload); it runs
+            # before the lock and before docs/ or the index change, so a failure changes nothing
+            chunks = self._embed_file(tmp_path, file_path)
+
+            with self.write_lock:
+                os.replace(tmp_path, file_path)
+                vectorstore = self._open_vectorstore()
+                try:
+                    self._remove_chunks(vectorstore, file_path)
+                    self._write_chunks(vectorstore, chunks)
+                except BaseException:
+                    # Leave docs/ and the index agreeing: drop the file and whatever got written
+                    os.remove(file_path)
+                    self._remove_chunks(vectorstore, file_path)
+                    raise
+                finally:
+                    self._commit(vectorstore)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete_file(self, filename: str):
+        file_path = os.path.join(self.upload_dir, filename)
+        with self.write_lock:
+            if not os.path.exists(file_path):
+                raise FileNotFoundError(file_path)
+            os.remove(file_path)
+
+            vectorstore = self._open_vectorstore()
+            self._remove_chunks(vectorstore, file_path)
+            self._commit(vectorstore)
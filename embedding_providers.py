@@ -0,0 +1,161 @@
+import atexit
+import hashlib
+import math
+import os
+import re
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+EMBEDDING_PROVIDERS = ("openai", "local", "hashing")
+DEFAULT_LOCAL_MODEL = "all-MiniLM-L6-v2"
+
+# Loaded sentence-transformers models, shared by every provider instance in the process
+_model_cache: Dict[str, Any] = {}
+_model_lock = threading.Lock()
+
+
+def load_sentence_transformer(model_name: str, device: str = "cpu"):
+    """Load a sentence-transformers model once per process and keep it in memory."""
+    key = f"{model_name}@{device}"
+    with _model_lock:
+        if key not in _model_cache:
+            from sentence_transformers import SentenceTransformer
+            _model_cache[key] = SentenceTransformer(model_name, device=device)
+        return _model_cache[key]
+
+
+def default_pool_processes() -> int:
+    """Cores per web worker, so the encode pools of all workers together use each core once."""
+    workers = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(value * value for value in vector))
+    if norm == 0:
+        return vector
+    return [value / norm for value in vector]
+
+
+class LocalSentenceTransformerEmbeddings(Embeddings):
+    """CPU embeddings from a local sentence-transformers model.
+
+    Texts are sorted by length and grouped into batches under a fixed padded-character
+    budget, so short chunks get large batches and long ones small batches. Large
+    document sets are spread over a multi-process encode pool sized by
+    `default_pool_processes`. The pool spawns processes that re-import the main module,
+    so servers should call `start_pool` at startup, before taking any lock those
+    processes could also try to take.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_LOCAL_MODEL,
+        processes: Optional[int] = None,
+        max_batch_chars: int = 64_000,
+        multi_process_threshold: int = 256,
+    ):
+        self.model_name = model_name
+        self.processes = processes or default_pool_processes()
+        self.max_batch_chars = max_batch_chars
+        self.multi_process_threshold = multi_process_threshold
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def model(self):
+        return load_sentence_transformer(self.model_name)
+
+    def _dynamic_batches(self, order: List[int], texts: List[str]) -> Iterator[List[int]]:
+        batch: List[int] = []
+        for index in order:
+            # Sorted ascending, so the current text is the longest in the batch
+            if batch and (len(batch) + 1) * len(texts[index]) > self.max_batch_chars:
+                yield batch
+                batch = []
+            batch.append(index)
+        if batch:
+            yield batch
+
+    def start_pool(self):
+        if self.processes <= 1:
+            return None
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = self.model.start_multi_process_pool(["cpu"] * self.processes)
+                atexit.register(self.close)
+            return self._pool
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self.model.stop_multi_process_pool(self._pool)
+                self._pool = None
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+
+        if self.processes > 1 and len(texts) >= self.multi_process_threshold:
+            median_length = max(1, len(texts[order[len(order) // 2]]))
+            batch_size = max(1, self.max_batch_chars // median_length)
+            vectors = self.model.encode_multi_process(texts, self.start_pool(), batch_size=batch_size)
+            return [_normalize(vector.tolist()) for vector in vectors]
+
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        for batch in self._dynamic_batches(order, texts):
+            vectors = self.model.encode(
+                [texts[index] for index in batch],
+                batch_size=len(batch),
+                normalize_embeddings=True,
+                show_progress_bar=False,
+            )
+            for index, vector in zip(batch, vectors):
+                results[index] = vector.tolist()
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.model.encode(text, normalize_embeddings=True, show_progress_bar=False).tolist()
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic, dependency-free embeddings for offline tests.
+
+    Uses the hashing trick on lowercased word unigrams and bigrams with a signed
+    blake2b hash, then L2-normalises. Similar texts get similar vectors, which is
+    enough for retrieval to behave sensibly without a model or network.
+    """
+
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        words = re.findall(r"\w+", text.lower())
+        features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+        for feature in features:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+            sign = 1.0 if digest & 1 else -1.0
+            vector[(digest >> 1) % self.dimensions] += sign
+        return _normalize(vector)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def get_embeddings(provider: str = "openai", **kwargs) -> Embeddings:
+    """Build the embedding backend named by `provider` ("openai", "local" or "hashing")."""
+    if provider == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(**kwargs)
+    if provider == "local":
+        return LocalSentenceTransformerEmbeddings(**kwargs)
+    if provider == "hashing":
+        return HashingEmbeddings(**kwargs)
+    raise ValueError(f"Unknown embedding provider {provider!r}; expected one of {', '.join(EMBEDDING_PROVIDERS)}")
@@ -0,0 +1,269 @@
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from filelock import FileLock, Timeout
+
+ARCHIVE_SUFFIX = ".ndjson.gz"
+LOG_COLUMNS = ("id", "session_id", "user_query", "gpt_response", "model", "created_at")
+# Latest turn or restore of a session, for queries over application_logs l LEFT JOIN archived_sessions a
+LAST_ACTIVITY = "MAX(MAX(l.created_at), COALESCE(MAX(a.restored_at), ''))"
+
+
+class LogLifecycle:
+    """Keeps application_logs bounded by moving cold sessions into compressed archives.
+
+    A session is cold once its latest turn is older than `retention_days`; if the hot
+    table still holds more than `max_hot_rows`, the least recently active sessions are
+    archived as well. Archives are gzip-compressed NDJSON files, one per batch, indexed
+    by the archived_sessions table so a resumed session can be restored. A restore
+    counts as activity, so a restored session stays hot for another retention period.
+    If a session logs turns while archived, the next archive run carries its earlier
+    turns into the new file, so one archive always holds a session's full history.
+    Archive files are written outside any database transaction; the write lock is only
+    held for the short check-and-delete step. Only one worker runs maintenance at a time.
+    """
+
+    def __init__(self, db_name: str, archive_dir: str, retention_days: float = 30,
+                 max_hot_rows: int = 100_000, interval_seconds: float = 3600,
+                 vacuum_every: int = 24, batch_sessions: int = 500):
+        self.db_name = db_name
+        self.archive_dir = archive_dir
+        self.retention_days = retention_days
+        self.max_hot_rows = max_hot_rows
+        self.interval_seconds = interval_seconds
+        self.vacuum_every = vacuum_every
+        self.batch_sessions = batch_sessions
+        self.maintenance_lock = FileLock(os.path.join(archive_dir, ".maintenance.lock"))
+        self._runs = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(archive_dir, exist_ok=True)
+        self._create_archived_sessions()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_name, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _create_archived_sessions(self):
+        conn = self._connect()
+        conn.execute('''CREATE TABLE IF NOT EXISTS archived_sessions
+                        (session_id TEXT PRIMARY KEY,
+                        archive_file TEXT NOT NULL,
+                        row_count INTEGER NOT NULL,
+                        last_activity TIMESTAMP,
+                        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        restored_at TIMESTAMP)''')
+        conn.commit()
+        conn.close()
+
+    # Archival
+    def _cold_sessions(self, conn) -> List[str]:
+        sessions = [row['session_id'] for row in conn.execute(
+            f'''SELECT l.session_id FROM application_logs l
+                LEFT JOIN archived_sessions a ON a.session_id = l.session_id
+                GROUP BY l.session_id
+                HAVING {LAST_ACTIVITY} < datetime('now', ?) ORDER BY {LAST_ACTIVITY} LIMIT ?''',
+            (f"-{self.retention_days} days", self.batch_sessions))]
+
+        hot_rows = conn.execute('SELECT COUNT(*) FROM application_logs').fetchone()[0]
+        excess = hot_rows - self.max_hot_rows
+        if excess > 0:
+            selected = set(sessions)
+            # Oldest first, so the age-selected sessions are counted before any new ones are added
+            for row in conn.execute(f'''SELECT l.session_id, COUNT(*) AS turns FROM application_logs l
+                                        LEFT JOIN archived_sessions a ON a.session_id = l.session_id
+                                        GROUP BY l.session_id ORDER BY {LAST_ACTIVITY}'''):
+                if excess <= 0 or len(sessions) >= self.batch_sessions:
+                    break
+                if row['session_id'] not in selected:
+                    sessions.append(row['session_id'])
+                excess -= row['turns']
+        return sessions
+
+    def archive_cold_sessions(self) -> int:
+        """Move one batch of cold sessions into a new archive file; return the number of sessions moved."""
+        conn = self._connect()
+        try:
+            sessions = self._cold_sessions(conn)
+            if not sessions:
+                return 0
+            placeholders = ",".join("?" * len(sessions))
+            rows = conn.execute(
+                f'''SELECT {", ".join(LOG_COLUMNS)} FROM application_logs
+                    WHERE session_id IN ({placeholders}) ORDER BY session_id, created_at, id''',
+                sessions).fetchall()
+            snapshot = {}
+            for row in rows:
+                turns, last_id = snapshot.get(row['session_id'], (0, 0))
+                snapshot[row['session_id']] = (turns + 1, max(last_id, row['id']))
+            # A session archived earlier that logged new turns without being restored still has
+            # its older turns in another file; they move into the new archive with the hot rows
+            previous = self._archive_entries(conn, sessions)
+            carried = self._read_archives(previous)
+
+            # Compress outside any transaction so chat turns are never blocked on disk I/O
+            filename = f"application_logs-{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}{ARCHIVE_SUFFIX}"
+            path = os.path.join(self.archive_dir, filename)
+            with gzip.open(path + ".part", "wt", encoding="utf-8") as archive:
+                for records in carried.values():
+                    for record in records:
+                        archive.write(json.dumps(record) + "\n")
+                for row in rows:
+                    archive.write(json.dumps(dict(row)) + "\n")
+            os.replace(path + ".part", path)
+
+            # Short write transaction: only sessions untouched since the snapshot are removed;
+            # anything that gained a turn or was restored in the meantime stays hot
+            conn.execute('BEGIN IMMEDIATE')
+            current = self._archive_entries(conn, sessions)
+            unchanged = [
+                row['session_id'] for row in conn.execute(
+                    f'''SELECT session_id, COUNT(*) AS turns, MAX(id) AS last_id FROM application_logs
+                        WHERE session_id IN ({placeholders}) GROUP BY session_id''', sessions)
+                if snapshot.get(row['session_id']) == (row['turns'], row['last_id'])
+                and current.get(row['session_id']) == previous.get(row['session_id'])
+            ]
+            if unchanged:
+                marks = ",".join("?" * len(unchanged))
+                conn.executemany(
+                    '''INSERT OR REPLACE INTO archived_sessions (session_id, archive_file, row_count, last_activity)
+                       SELECT session_id, ?, COUNT(*) + ?, MAX(created_at) FROM application_logs WHERE session_id = ?''',
+                    [(filename, len(carried.get(session_id, ())), session_id) for session_id in unchanged])
+                conn.execute(f'DELETE FROM application_logs WHERE session_id IN ({marks})', unchanged)
+            conn.commit()
+            return len(unchanged)
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _archive_entries(self, conn, sessions: List[str]) -> Dict[str, str]:
+        """Archive file of each session that is archived and not restored."""
+        placeholders = ",".join("?" * len(sessions))
+        return {row['session_id']: row['archive_file'] for row in conn.execute(
+            f'''SELECT session_id, archive_file FROM archived_sessions
+                WHERE session_id IN ({placeholders}) AND restored_at IS NULL''', sessions)}
+
+    def _read_archives(self, entries: Dict[str, str]) -> Dict[str, List[dict]]:
+        """Archived turns of each session, read from the archive file it maps to."""
+        by_file: Dict[str, set] = {}
+        for session_id, archive_file in entries.items():
+            by_file.setdefault(archive_file, set()).add(session_id)
+        records: Dict[str, List[dict]] = {}
+        for archive_file, session_ids in by_file.items():
+            with gzip.open(os.path.join(self.archive_dir, archive_file), "rt", encoding="utf-8") as archive:
+                for line in archive:
+                    record = json.loads(line)
+                    if record["session_id"] in session_ids:
+                        records.setdefault(record["session_id"], []).append(record)
+        return records
+
+    def is_archived(self, session_id: str) -> bool:
+        conn = self._connect()
+        row = conn.execute('SELECT 1 FROM archived_sessions WHERE session_id = ? AND restored_at IS NULL',
+                           (session_id,)).fetchone()
+        conn.close()
+        return row is not None
+
+    def restore_session(self, session_id: str) -> int:
+        """Move an archived session back into application_logs; return the number of turns restored."""
+        conn = self._connect()
+        try:
+            entry = conn.execute('SELECT archive_file FROM archived_sessions WHERE session_id = ? AND restored_at IS NULL',
+                                 (session_id,)).fetchone()
+            if entry is None:
+                return 0
+
+            # Decompress before taking the write lock
+            records = self._read_archives({session_id: entry['archive_file']}).get(session_id, [])
+            rows = [tuple(record[column] for column in LOG_COLUMNS) for record in records]
+
+            conn.execute('BEGIN IMMEDIATE')
+            # Recording the restore keeps the session out of the next few maintenance runs
+            restored = conn.execute(
+                '''UPDATE archived_sessions SET restored_at = CURRENT_TIMESTAMP
+                   WHERE session_id = ? AND archive_file = ? AND restored_at IS NULL''',
+                (session_id, entry['archive_file'])).rowcount
+            if not restored:
+                # Restored concurrently by another request
+                conn.rollback()
+                return 0
+            # Original ids and timestamps are kept so history order is unchanged
+            conn.executemany(
+                f'''INSERT OR IGNORE INTO application_logs ({", ".join(LOG_COLUMNS)})
+                    VALUES ({",".join("?" * len(LOG_COLUMNS))})''',
+                rows)
+            conn.commit()
+            return len(rows)
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def purge_unreferenced_archives(self) -> int:
+        """Delete archive files whose sessions have all been restored or re-archived elsewhere."""
+        conn = self._connect()
+        referenced = {row['archive_file'] for row in conn.execute(
+            'SELECT DISTINCT archive_file FROM archived_sessions WHERE restored_at IS NULL')}
+        conn.close()
+        removed = 0
+        for filename in os.listdir(self.archive_dir):
+            if filename.endswith(ARCHIVE_SUFFIX) and filename not in referenced:
+                os.remove(os.path.join(self.archive_dir, filename))
+                removed += 1
+        return removed
+
+    # Compaction
+    def compact(self, vacuum: bool = False):
+        conn = self._connect()
+        conn.execute('ANALYZE')
+        if vacuum:
+            conn.execute('VACUUM')
+        conn.close()
+
+    # Scheduling
+    def run_maintenance(self) -> bool:
+        """Archive cold sessions and compact the database; return False if another worker holds the lock."""
+        try:
+            self.maintenance_lock.acquire(timeout=0)
+        except Timeout:
+            return False
+        try:
+            while self.archive_cold_sessions() == self.batch_sessions:
+                if self._stop.is_set():
+                    break
+            self.purge_unreferenced_archives()
+            self._runs += 1
+            self.compact(vacuum=self._runs % self.vacuum_every == 0)
+            return True
+        finally:
+            self.maintenance_lock.release()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self.run_maintenance()
+            except Exception as e:
+                print(f"Log maintenance failed: {e}")
+            self._stop.wait(self.interval_seconds)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="log-lifecycle", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
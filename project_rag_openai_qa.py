@@ -126,11 +126,19 @@ splits[0].page_content
 
 splits[36].page_content
 
-"""# EMBEDDING USING OPENAI"""
+"""# EMBEDDING
 
-from langchain_openai import OpenAIEmbeddings
+Choose the embedding backend: "openai", "local" (sentence-transformers on CPU, no network round trips) or "hashing" (deterministic, offline)
+"""
+
+from embedding_providers import get_embeddings
+
+EMBEDDING_PROVIDER = os.environ.get('EMBEDDING_PROVIDER', 'openai')
+
+# Notebook cells have no __main__ guard, so the local backend encodes in-process instead of spawning a pool
+embedding_kwargs = {'processes': 1} if EMBEDDING_PROVIDER == 'local' else {}
 
-embeddings = OpenAIEmbeddings()
+embeddings = get_embeddings(EMBEDDING_PROVIDER, **embedding_kwargs)
 
 document_embeddings = embeddings.embed_documents([split.page_content for split in splits])
 
@@ -140,10 +148,9 @@ print(f"Number of document embeddings: {len(document_embeddings)}")
 """# STORE THE EMBEDDED VECTORS INTO CHROMEDB"""
 
 from langchain.vectorstores import Chroma
-from langchain.embeddings.openai import OpenAIEmbeddings
 
-# Initialize OpenAI Embeddings
-embedding_function = OpenAIEmbeddings()
+# Reuse the embedding backend selected above
+embedding_function = embeddings
 
 # Define collection name and persistence directory
 collection_name = "my_collection"
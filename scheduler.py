@@ -0,0 +1,317 @@
+import contextlib
+import functools
+import heapq
+import itertools
+import math
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import anyio
+import openai
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable, RunnableLambda
+
+# Priority classes; lower values are admitted first
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Provider errors worth retrying; anything else is surfaced immediately
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+class SchedulerOverloaded(Exception):
+    """Raised when a priority class queue is full."""
+
+    def __init__(self, priority: int, retry_after: float):
+        super().__init__(f"{PRIORITY_NAMES[priority]} model queue is full")
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), good enough for rate limiting."""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` units per second."""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + max(0.0, now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount: float) -> float:
+        """Seconds until `amount` units are available (0 if available now)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+
+class SharedBucketState:
+    """Token bucket levels kept in a SQLite file, so every worker process draws on one budget.
+
+    Levels are loaded, checked and written back inside one IMMEDIATE transaction, so two
+    workers can never both spend the last tokens. They are timestamped with wall-clock
+    time, since monotonic clocks are not comparable across processes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._created = False
+
+    def _connect(self):
+        # Autocommit mode, so the transaction below is exactly the one we begin
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._created:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''CREATE TABLE IF NOT EXISTS token_buckets
+                            (name TEXT PRIMARY KEY,
+                            tokens REAL NOT NULL,
+                            updated REAL NOT NULL)''')
+            self._created = True
+        return conn
+
+    @contextlib.contextmanager
+    def synced(self, buckets: Dict[str, TokenBucket]):
+        """Load the shared levels into `buckets`, and write back what they hold on exit."""
+        conn = self._connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for name, tokens, updated in conn.execute('SELECT name, tokens, updated FROM token_buckets'):
+                if name in buckets:
+                    buckets[name].tokens = tokens
+                    buckets[name].updated = updated
+            yield
+            conn.executemany(
+                '''INSERT INTO token_buckets (name, tokens, updated) VALUES (?, ?, ?)
+                   ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated''',
+                [(name, bucket.tokens, bucket.updated) for name, bucket in buckets.items()])
+            conn.execute('COMMIT')
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+
+class ModelCallScheduler:
+    """Admission control for outbound model calls.
+
+    Callers queue by priority class and are admitted strictly in (priority, arrival)
+    order once both the request and token buckets allow it. Each class has a bounded
+    queue; when it is full the call is rejected with SchedulerOverloaded instead of
+    piling up. Retryable provider errors are retried with full-jitter exponential
+    backoff, re-entering the queue each time.
+
+    Async callers should go through `run_admitted`, which reserves a slot on the event
+    loop (rejecting immediately when the class is full) and then runs the blocking work
+    on a thread limiter of its own, so waiting model calls never hold threads from the
+    shared pool and never pile up where the queue bound cannot see them.
+
+    Rate limits are per scheduler unless `state_path` is given, in which case every
+    scheduler opened on that file (one per worker process) shares the same buckets and
+    the limits apply to the deployment as a whole. Queues and priorities stay per process.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 500,
+        tokens_per_minute: float = 200_000,
+        max_queue_size: int = 100,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+        state_path: Optional[str] = None,
+    ):
+        self.shared_state = SharedBucketState(state_path) if state_path else None
+        clock = time.time if self.shared_state else time.monotonic
+        # Buckets hold one minute of budget, matching how providers express RPM/TPM limits
+        self.request_bucket = TokenBucket(requests_per_minute / 60.0, requests_per_minute, clock)
+        self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute, clock)
+        self.max_queue_size = max_queue_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._cond = threading.Condition()
+        self._heap: List[Tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._in_flight = {priority: 0 for priority in PRIORITY_NAMES}
+        self._limiters: Dict[int, anyio.CapacityLimiter] = {}
+        self._stats: Dict[int, Dict[str, float]] = {
+            priority: {"admitted": 0, "rejected": 0, "retries": 0, "total_wait": 0.0, "max_wait": 0.0}
+            for priority in PRIORITY_NAMES
+        }
+
+    def _queued(self, priority: int) -> int:
+        return sum(1 for entry in self._heap if entry[0] == priority)
+
+    def _overloaded(self, priority: int, pending: int) -> SchedulerOverloaded:
+        self._stats[priority]["rejected"] += 1
+        return SchedulerOverloaded(priority, (pending + 1) / self.request_bucket.rate)
+
+    def _take(self, tokens: int) -> float:
+        """Spend one request and `tokens` if both buckets allow it; otherwise return the wait."""
+        if self.shared_state is None:
+            synced = contextlib.nullcontext()
+        else:
+            synced = self.shared_state.synced({"requests": self.request_bucket, "tokens": self.token_bucket})
+        with synced:
+            delay = max(self.request_bucket.delay_for(1), self.token_bucket.delay_for(tokens))
+            if delay <= 0:
+                self.request_bucket.consume(1)
+                self.token_bucket.consume(tokens)
+            return delay
+
+    def reserve(self, priority: int):
+        """Claim a request slot without blocking; raise SchedulerOverloaded if the class is full."""
+        with self._cond:
+            if self._in_flight[priority] >= self.max_queue_size:
+                raise self._overloaded(priority, sum(self._in_flight.values()))
+            self._in_flight[priority] += 1
+
+    def release(self, priority: int):
+        with self._cond:
+            self._in_flight[priority] -= 1
+
+    async def run_admitted(self, priority: int, fn: Callable[..., Any], *args) -> Any:
+        """Admit on the event loop, then run `fn(*args)` on a thread reserved for this class."""
+        self.reserve(priority)
+        try:
+            limiter = self._limiters.get(priority)
+            if limiter is None:
+                # One thread per slot, so an admitted request never waits for a thread
+                limiter = self._limiters[priority] = anyio.CapacityLimiter(self.max_queue_size)
+            return await anyio.to_thread.run_sync(functools.partial(fn, *args), limiter=limiter)
+        finally:
+            self.release(priority)
+
+    def acquire(self, priority: int, tokens: int = 1):
+        """Block until the call may proceed; raise SchedulerOverloaded if the queue is full."""
+        with self._cond:
+            if self._queued(priority) >= self.max_queue_size:
+                raise self._overloaded(priority, len(self._heap))
+
+            entry = (priority, next(self._seq))
+            heapq.heappush(self._heap, entry)
+            enqueued = time.monotonic()
+            try:
+                while True:
+                    if self._heap[0] == entry:
+                        delay = self._take(tokens)
+                        if delay <= 0:
+                            heapq.heappop(self._heap)
+                            break
+                        self._cond.wait(delay)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                self._heap.remove(entry)
+                heapq.heapify(self._heap)
+                raise
+            finally:
+                self._cond.notify_all()
+
+            waited = time.monotonic() - enqueued
+            stats = self._stats[priority]
+            stats["admitted"] += 1
+            stats["total_wait"] += waited
+            stats["max_wait"] = max(stats["max_wait"], waited)
+
+    def submit(self, priority: int, fn: Callable[[], Any], tokens: int = 1) -> Any:
+        """Run `fn` once admitted, retrying retryable provider errors with jittered backoff."""
+        attempt = 0
+        while True:
+            self.acquire(priority, tokens)
+            try:
+                return fn()
+            except RETRYABLE_ERRORS:
+                if attempt >= self.max_retries:
+                    raise
+                with self._cond:
+                    self._stats[priority]["retries"] += 1
+                time.sleep(random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt)))
+                attempt += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            classes = {}
+            for priority, name in PRIORITY_NAMES.items():
+                stats = self._stats[priority]
+                admitted = stats["admitted"]
+                classes[name] = {
+                    "queue_depth": self._queued(priority),
+                    "in_flight_requests": self._in_flight[priority],
+                    "admitted": int(admitted),
+                    "rejected": int(stats["rejected"]),
+                    "retries": int(stats["retries"]),
+                    "avg_wait_seconds": stats["total_wait"] / admitted if admitted else 0.0,
+                    "max_wait_seconds": stats["max_wait"],
+                }
+            return {"queue_depth": len(self._heap), "max_queue_size": self.max_queue_size, "classes": classes}
+
+
+def _input_text(value: Any) -> str:
+    if hasattr(value, "to_string"):
+        return value.to_string()
+    return str(value)
+
+
+def scheduled_runnable(runnable: Runnable, scheduler: ModelCallScheduler, priority: int = INTERACTIVE,
+                       max_output_tokens: int = 512) -> Runnable:
+    """Wrap a chat model so every invocation is admitted through the scheduler."""
+
+    def invoke(value):
+        tokens = estimate_tokens(_input_text(value)) + max_output_tokens
+        return scheduler.submit(priority, lambda: runnable.invoke(value), tokens)
+
+    return RunnableLambda(invoke)
+
+
+class ScheduledEmbeddings(Embeddings):
+    """Embeddings wrapper: document batches run as bulk work, single queries as interactive."""
+
+    def __init__(self, embeddings: Embeddings, scheduler: ModelCallScheduler, batch_size: int = 256):
+        self.embeddings = embeddings
+        self.scheduler = scheduler
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        # Submit in batches so one large re-index cannot monopolise the token bucket
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start:start + self.batch_size]
+            tokens = sum(estimate_tokens(text) for text in batch)
+            vectors.extend(self.scheduler.submit(BULK, lambda: self.embeddings.embed_documents(batch), tokens))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.scheduler.submit(INTERACTIVE, lambda: self.embeddings.embed_query(text), estimate_tokens(text))
+
+
+def retry_after_header(exc: SchedulerOverloaded) -> Dict[str, str]:
+    return {"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
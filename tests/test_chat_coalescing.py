@@ -0,0 +1,148 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+os.environ.setdefault("EMBEDDING_PROVIDER", "hashing")
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+import httpx
+import pytest
+
+import app as rag_app
+from log_lifecycle import LogLifecycle
+
+CONCURRENT_REQUESTS = 25
+
+
+class FakeCorpus:
+    def __init__(self):
+        self.version = 1
+
+    def current_version(self):
+        return self.version
+
+
+class CountingAnswerer:
+    """Stands in for retrieval plus generation; slow enough that callers overlap."""
+
+    def __init__(self, delay: float = 0.3):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, question, chat_history):
+        with self.lock:
+            self.calls.append((question, len(chat_history)))
+        time.sleep(self.delay)
+        return f"answer to {question.strip()}"
+
+
+@pytest.fixture
+def answerer(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_app, "DB_NAME", str(tmp_path / "rag_app.db"))
+    rag_app.create_application_logs()
+    monkeypatch.setattr(rag_app, "log_lifecycle", LogLifecycle(rag_app.DB_NAME, str(tmp_path / "log_archive")))
+    monkeypatch.setattr(rag_app, "corpus", FakeCorpus())
+    answerer = CountingAnswerer()
+    monkeypatch.setattr(rag_app, "answer_question", answerer)
+    return answerer
+
+
+def post_chats(payloads):
+    async def main():
+        transport = httpx.ASGITransport(app=rag_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*[client.post("/chat", json=payload) for payload in payloads])
+
+    return asyncio.run(main())
+
+
+def logged_sessions():
+    conn = sqlite3.connect(rag_app.DB_NAME)
+    rows = conn.execute('SELECT session_id FROM application_logs').fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+def test_identical_first_turn_questions_share_one_model_call(answerer):
+    variants = ["What is CAG?", "what is cag?", "  What   is CAG? "]
+    payloads = [{"question": variants[index % len(variants)]} for index in range(CONCURRENT_REQUESTS)]
+
+    responses = post_chats(payloads)
+
+    assert all(response.status_code == 200 for response in responses)
+    assert len(answerer.calls) == 1
+    assert len({response.json()["answer"] for response in responses}) == 1
+    # Every caller still gets its own session and its own log row
+    session_ids = [response.json()["session_id"] for response in responses]
+    assert len(set(session_ids)) == CONCURRENT_REQUESTS
+    assert sorted(logged_sessions()) == sorted(session_ids)
+
+
+def test_different_questions_and_follow_ups_are_not_shared(answerer):
+    first = post_chats([{"question": "What is CAG?"}])[0].json()
+
+    responses = post_chats([
+        {"question": "What is RAG?"},
+        {"question": "What is RAG?"},
+        {"question": "What is CAG?", "session_id": first["session_id"]},
+        {"question": "What is CAG?", "session_id": first["session_id"]},
+    ])
+
+    assert all(response.status_code == 200 for response in responses)
+    # One shared call for the new question, and one each for the turns with history
+    assert sorted(answerer.calls) == sorted([
+        ("What is CAG?", 0),
+        ("What is RAG?", 0),
+        ("What is CAG?", 2),
+        ("What is CAG?", 2),
+    ])
+
+
+def test_a_new_corpus_version_is_not_answered_from_an_in_flight_run(answerer):
+    async def main():
+        transport = httpx.ASGITransport(app=rag_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            before = asyncio.ensure_future(client.post("/chat", json={"question": "What is CAG?"}))
+            await asyncio.sleep(0.1)
+            rag_app.corpus.version += 1
+            after = await client.post("/chat", json={"question": "What is CAG?"})
+            return await before, after
+
+    before, after = asyncio.run(main())
+
+    assert before.status_code == after.status_code == 200
+    assert len(answerer.calls) == 2
+
+
+def test_slow_history_restore_does_not_stall_other_chats(answerer, monkeypatch):
+    release = threading.Event()
+    released = []
+    read_history = rag_app.get_chat_history
+
+    def slow_history(session_id):
+        if session_id == "archived":
+            # Stands in for decompressing an archive and waiting on a maintenance transaction
+            released.append(release.wait(timeout=2))
+        return read_history(session_id)
+
+    monkeypatch.setattr(rag_app, "get_chat_history", slow_history)
+    answerer.delay = 0
+
+    async def main():
+        transport = httpx.ASGITransport(app=rag_app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            slow = asyncio.ensure_future(client.post("/chat", json={"question": "Hi", "session_id": "archived"}))
+            await asyncio.sleep(0.05)
+            fast = await client.post("/chat", json={"question": "What is CAG?"})
+            release.set()
+            return await slow, fast
+
+    slow, fast = asyncio.run(main())
+
+    assert slow.status_code == fast.status_code == 200
+    # The other chat finished while the restore was still waiting, so the wait ended by release
+    assert released == [True]
@@ -0,0 +1,183 @@
+import io
+import multiprocessing
+import os
+import zipfile
+from collections import Counter
+
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+
+import pytest
+
+from corpus_store import CorpusStore, load_document
+from embedding_providers import HashingEmbeddings
+
+COLLECTION = "rag_hashing"
+CHUNK_SIZE = 200
+WRITERS = 3
+FILES_PER_WRITER = 4
+READERS = 2
+
+
+def make_docx(text: str) -> bytes:
+    """Smallest .docx that docx2txt can read: a zip holding word/document.xml."""
+    paragraphs = "".join(f"<w:p><w:r><w:t>{line}</w:t></w:r></w:p>" for line in text.split("\n"))
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{paragraphs}</w:body></w:document>"
+    )
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("word/document.xml", document)
+    return buffer.getvalue()
+
+
+def document_text(name: str, paragraphs: int) -> str:
+    return "\n".join(f"{name} paragraph {index} about topic {index % 5} with some filler words"
+                     for index in range(paragraphs))
+
+
+def open_store(root: str, collection_name: str = COLLECTION) -> CorpusStore:
+    return CorpusStore(
+        os.path.join(root, "docs"),
+        os.path.join(root, "chroma_db"),
+        os.path.join(root, "rag_app.db"),
+        HashingEmbeddings(),
+        collection_name=collection_name,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=20,
+    )
+
+
+def writer(root: str, writer_id: int):
+    store = open_store(root)
+    store.initialize()
+    for index in range(FILES_PER_WRITER):
+        name = f"writer{writer_id}_{index}"
+        store.add_file(f"{name}.docx", io.BytesIO(make_docx(document_text(name, 10 + index * 3))))
+        # Every writer also re-uploads the same shared file, with different lengths
+        shared = document_text(f"shared{writer_id}", 5 + writer_id * 4 + index)
+        store.add_file("shared.docx", io.BytesIO(make_docx(shared)))
+
+
+def reader(root: str, stop, results):
+    store = open_store(root)
+    store.initialize()
+    while not stop.is_set():
+        store.get_vectorstore().similarity_search("paragraph about topic 3", k=2)
+    # What this long-lived worker can retrieve once the writers are done
+    results.put(dict(searchable_counts(store)))
+
+
+def chunk_counts(store: CorpusStore) -> Counter:
+    metadatas = store.get_vectorstore()._collection.get(include=["metadatas"])["metadatas"]
+    return Counter(metadata["source"] for metadata in metadatas)
+
+
+def searchable_counts(store: CorpusStore) -> Counter:
+    """Chunks reachable through the vector index, which is where stale readers show up."""
+    documents = store.get_vectorstore().similarity_search("paragraph about topic", k=10_000)
+    return Counter(document.metadata["source"] for document in documents)
+
+
+def expected_counts(store: CorpusStore) -> Counter:
+    expected = Counter()
+    for filename in os.listdir(store.upload_dir):
+        if filename.endswith(".docx"):
+            file_path = os.path.join(store.upload_dir, filename)
+            expected[file_path] = len(store.text_splitter.split_documents(load_document(file_path)))
+    return expected
+
+
+@pytest.fixture
+def root(tmp_path):
+    os.makedirs(tmp_path / "docs")
+    os.makedirs(tmp_path / "chroma_db")
+    return str(tmp_path)
+
+
+def test_concurrent_uploads_and_chats_keep_one_copy_of_every_chunk(root):
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    results = context.Queue()
+    readers = [context.Process(target=reader, args=(root, stop, results)) for _ in range(READERS)]
+    writers = [context.Process(target=writer, args=(root, writer_id)) for writer_id in range(WRITERS)]
+    for process in readers + writers:
+        process.start()
+    for process in writers:
+        process.join(timeout=300)
+    stop.set()
+    reader_counts = [results.get(timeout=60) for _ in readers]
+    for process in readers:
+        process.join(timeout=60)
+    assert all(process.exitcode == 0 for process in readers + writers)
+
+    store = open_store(root)
+    store.initialize()
+    expected = expected_counts(store)
+    assert len(expected) == WRITERS * FILES_PER_WRITER + 1
+    # No duplicates, no lost chunks and nothing left over from an older copy of shared.docx
+    assert chunk_counts(store) == expected
+    assert searchable_counts(store) == expected
+    assert all(Counter(counts) == expected for counts in reader_counts)
+    # Every upload bumped the version once, on top of the initial build
+    assert store.current_version() == 1 + WRITERS * FILES_PER_WRITER * 2
+
+
+def test_reader_picks_up_writes_from_another_store(root):
+    writer_store = open_store(root)
+    writer_store.initialize()
+    reader_store = open_store(root)
+    reader_store.initialize()
+    writer_store.add_file("first.docx", io.BytesIO(make_docx(document_text("first", 6))))
+    assert searchable_counts(reader_store) == expected_counts(reader_store)
+
+    writer_store.add_file("notes.docx", io.BytesIO(make_docx(document_text("notes", 12))))
+
+    assert searchable_counts(reader_store) == expected_counts(reader_store)
+
+
+def test_reader_keeps_serving_while_a_write_is_in_progress(root):
+    store = open_store(root)
+    store.initialize()
+    current = store.get_vectorstore()
+    store._bump_version()
+
+    with open_store(root).write_lock:
+        # The lock is held elsewhere, so the old store is served instead of blocking
+        assert store.get_vectorstore() is current
+    assert store.get_vectorstore() is not current
+
+
+def test_failed_upload_leaves_docs_and_index_untouched(root):
+    class FailingEmbeddings(HashingEmbeddings):
+        def embed_documents(self, texts):
+            raise RuntimeError("provider unavailable")
+
+    store = open_store(root)
+    store.initialize()
+    version = store.current_version()
+    store.embeddings = FailingEmbeddings()
+
+    with pytest.raises(RuntimeError):
+        store.add_file("broken.docx", io.BytesIO(make_docx(document_text("broken", 10))))
+
+    assert not os.path.exists(os.path.join(store.upload_dir, "broken.docx"))
+    assert os.listdir(os.path.join(store.upload_dir, ".staging")) == []
+    assert store.current_version() == version
+    assert store.get_vectorstore()._collection.count() == 0
+
+
+def test_versions_are_kept_per_collection(root):
+    with open(os.path.join(root, "docs", "intro.docx"), "wb") as handle:
+        handle.write(make_docx(document_text("intro", 12)))
+    first = open_store(root, "rag_hashing")
+    first.initialize()
+    first.add_file("more.docx", io.BytesIO(make_docx(document_text("more", 8))))
+
+    # Switching provider builds the new collection instead of opening it empty
+    second = open_store(root, "rag_other")
+    second.initialize()
+    assert second.current_version() == 1
+    assert first.current_version() == 2
+    assert chunk_counts(second) == expected_counts(second)
@@ -0,0 +1,82 @@
+import math
+
+import numpy as np
+import pytest
+
+import embedding_providers
+from embedding_providers import HashingEmbeddings, LocalSentenceTransformerEmbeddings, get_embeddings
+
+
+class StubModel:
+    """Stands in for a SentenceTransformer: records each encode call and returns vectors tied to the text."""
+
+    def __init__(self):
+        self.batches = []
+
+    def encode(self, sentences, batch_size=32, normalize_embeddings=False, show_progress_bar=None):
+        if isinstance(sentences, str):
+            return np.array([float(len(sentences)), 1.0])
+        self.batches.append(list(sentences))
+        return np.array([[float(len(text)), float(sum(map(ord, text)))] for text in sentences])
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = StubModel()
+    monkeypatch.setattr(embedding_providers, "load_sentence_transformer", lambda model_name, device="cpu": model)
+    return model
+
+
+def norm(vector):
+    return math.sqrt(sum(value * value for value in vector))
+
+
+def test_hashing_embeddings_are_deterministic_and_normalised():
+    texts = ["What is retrieval augmented generation?", "Chroma stores the vectors", "x"]
+
+    first = HashingEmbeddings().embed_documents(texts)
+    second = HashingEmbeddings().embed_documents(texts)
+
+    assert first == second
+    assert first[0] == HashingEmbeddings().embed_query(texts[0])
+    assert all(len(vector) == 384 for vector in first)
+    assert all(norm(vector) == pytest.approx(1.0) for vector in first)
+    # Nothing to hash is left as a zero vector rather than divided by zero
+    assert norm(HashingEmbeddings(dimensions=16).embed_query("")) == 0
+
+
+def test_hashing_embeddings_rank_overlapping_text_closer():
+    embeddings = HashingEmbeddings()
+    query = embeddings.embed_query("how are uploaded documents chunked")
+    related = embeddings.embed_query("uploaded documents are chunked before embedding")
+    unrelated = embeddings.embed_query("the scheduler returns 429 when the queue is full")
+
+    def similarity(vector):
+        return sum(a * b for a, b in zip(query, vector))
+
+    assert similarity(related) > similarity(unrelated)
+
+
+def test_dynamic_batches_stay_within_the_padded_character_budget(model):
+    texts = [("word " * length).strip() for length in (40, 3, 120, 7, 7, 60, 1, 200, 15, 90)]
+    embeddings = LocalSentenceTransformerEmbeddings(processes=1, max_batch_chars=1_000)
+
+    embeddings.embed_documents(texts)
+
+    assert sorted(text for batch in model.batches for text in batch) == sorted(texts)
+    for batch in model.batches:
+        # Batches are padded to their longest text; a text over budget on its own still gets a batch
+        assert len(batch) == 1 or len(batch) * max(map(len, batch)) <= 1_000
+    # Length-sorted, so short texts share large batches
+    assert len(model.batches[0]) > len(model.batches[-1])
+
+
+def test_local_embeddings_come_back_in_input_order(model):
+    texts = ["a much longer chunk of text than the others", "short", "medium length chunk", "tiny", ""]
+    embeddings = get_embeddings("local", processes=1, max_batch_chars=40)
+
+    vectors = embeddings.embed_documents(texts)
+
+    assert len(model.batches) > 1
+    assert vectors == [[float(len(text)), float(sum(map(ord, text)))] for text in texts]
+    assert embeddings.embed_documents([]) == []
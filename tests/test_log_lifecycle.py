@@ -0,0 +1,124 @@
+import gzip
+import os
+import sqlite3
+
+import pytest
+
+import log_lifecycle
+from log_lifecycle import LogLifecycle
+
+
+def create_logs(db_name):
+    conn = sqlite3.connect(db_name)
+    conn.execute('''CREATE TABLE IF NOT EXISTS application_logs
+                    (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT,
+                    user_query TEXT,
+                    gpt_response TEXT,
+                    model TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.commit()
+    conn.close()
+
+
+def add_turns(db_name, session_id, turns, days_ago, timeout=5.0):
+    conn = sqlite3.connect(db_name, timeout=timeout)
+    conn.executemany(
+        '''INSERT INTO application_logs (session_id, user_query, gpt_response, model, created_at)
+           VALUES (?, ?, ?, 'gpt-4o-mini', datetime('now', ?))''',
+        [(session_id, f"question {turn}", f"answer {turn}", f"-{days_ago} days") for turn in range(turns)])
+    conn.commit()
+    conn.close()
+
+
+def hot_sessions(db_name):
+    conn = sqlite3.connect(db_name)
+    rows = conn.execute('SELECT session_id, COUNT(*) FROM application_logs GROUP BY session_id').fetchall()
+    conn.close()
+    return dict(rows)
+
+
+@pytest.fixture
+def db_name(tmp_path):
+    db_name = str(tmp_path / "rag_app.db")
+    create_logs(db_name)
+    return db_name
+
+
+@pytest.fixture
+def lifecycle(db_name, tmp_path):
+    return LogLifecycle(db_name, str(tmp_path / "log_archive"), retention_days=30, max_hot_rows=100)
+
+
+def test_sessions_past_retention_are_archived(db_name, lifecycle):
+    add_turns(db_name, "old", 3, days_ago=40)
+    add_turns(db_name, "recent", 2, days_ago=1)
+
+    assert lifecycle.run_maintenance()
+
+    assert hot_sessions(db_name) == {"recent": 2}
+    assert lifecycle.is_archived("old")
+    archives = [name for name in os.listdir(lifecycle.archive_dir) if name.endswith(".ndjson.gz")]
+    assert len(archives) == 1
+    with gzip.open(os.path.join(lifecycle.archive_dir, archives[0]), "rt") as archive:
+        assert len(archive.readlines()) == 3
+
+
+def test_hot_table_is_capped_by_archiving_least_recent_sessions(db_name, lifecycle):
+    lifecycle.max_hot_rows = 6
+    for index in range(5):
+        add_turns(db_name, f"session{index}", 3, days_ago=10 - index)
+
+    lifecycle.run_maintenance()
+
+    assert hot_sessions(db_name) == {"session3": 3, "session4": 3}
+
+
+def test_restored_session_is_not_archived_again_by_the_next_run(db_name, lifecycle):
+    add_turns(db_name, "resumed", 4, days_ago=60)
+    lifecycle.run_maintenance()
+    assert hot_sessions(db_name) == {}
+
+    assert lifecycle.restore_session("resumed") == 4
+    assert not lifecycle.is_archived("resumed")
+    assert lifecycle.restore_session("resumed") == 0
+
+    lifecycle.run_maintenance()
+    assert hot_sessions(db_name) == {"resumed": 4}
+    # The restored session's archive is no longer needed
+    assert not [name for name in os.listdir(lifecycle.archive_dir) if name.endswith(".ndjson.gz")]
+
+
+def test_archive_is_written_without_holding_the_database(db_name, lifecycle, monkeypatch):
+    add_turns(db_name, "cold", 2, days_ago=45)
+    add_turns(db_name, "returning", 2, days_ago=45)
+    real_open = gzip.open
+
+    def open_and_log_a_turn(*args, **kwargs):
+        # A chat turn while the archive is being compressed must not wait on a lock...
+        add_turns(db_name, "returning", 1, days_ago=0, timeout=0.1)
+        return real_open(*args, **kwargs)
+
+    monkeypatch.setattr(log_lifecycle.gzip, "open", open_and_log_a_turn)
+    lifecycle.archive_cold_sessions()
+
+    # ...and a session that gained a turn meanwhile stays hot and complete
+    assert hot_sessions(db_name) == {"returning": 3}
+    assert lifecycle.is_archived("cold")
+    assert not lifecycle.is_archived("returning")
+
+
+def test_session_archived_again_keeps_its_earlier_archived_turns(db_name, lifecycle):
+    add_turns(db_name, "S", 3, days_ago=40)
+    lifecycle.run_maintenance()
+    assert hot_sessions(db_name) == {}
+
+    # A turn logged without a restore, e.g. archived between reading history and logging the answer
+    add_turns(db_name, "S", 1, days_ago=35)
+    lifecycle.run_maintenance()
+
+    assert hot_sessions(db_name) == {}
+    archives = [name for name in os.listdir(lifecycle.archive_dir) if name.endswith(".ndjson.gz")]
+    assert len(archives) == 1
+    assert lifecycle.restore_session("S") == 4
+    assert hot_sessions(db_name) == {"S": 4}
@@ -0,0 +1,160 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+from scheduler import (
+    BULK,
+    INTERACTIVE,
+    ModelCallScheduler,
+    SchedulerOverloaded,
+    retry_after_header,
+)
+
+
+def rate_limit_error():
+    request = httpx.Request("POST", "http://fake-provider/v1/chat/completions")
+    return openai.RateLimitError("rate limited", response=httpx.Response(429, request=request), body=None)
+
+
+class FakeProvider:
+    """Local stand-in for the model API that enforces a calls-per-window rate limit."""
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.calls = []
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def call(self, value=None):
+        with self.lock:
+            now = time.monotonic()
+            self.calls = [called for called in self.calls if now - called < self.window]
+            if len(self.calls) >= self.limit:
+                self.rejected += 1
+                raise rate_limit_error()
+            self.calls.append(now)
+            return value
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for condition"
+        time.sleep(0.01)
+
+
+def test_interactive_calls_are_admitted_before_queued_bulk_calls():
+    scheduler = ModelCallScheduler(requests_per_minute=60, max_queue_size=10)
+    # Drain the request bucket so everything queues up behind it
+    with scheduler._cond:
+        scheduler.request_bucket.tokens = 0
+        scheduler.request_bucket.rate = 1e-9
+
+    order = []
+    threads = [threading.Thread(target=scheduler.submit, args=(BULK, lambda i=i: order.append(("bulk", i))))
+               for i in range(3)]
+    threads += [threading.Thread(target=scheduler.submit, args=(INTERACTIVE, lambda i=i: order.append(("chat", i))))
+                for i in range(2)]
+    for thread in threads:
+        thread.start()
+    wait_for(lambda: scheduler.stats()["queue_depth"] == 5)
+
+    with scheduler._cond:
+        scheduler.request_bucket.rate = 1000.0
+        scheduler._cond.notify_all()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert [kind for kind, _ in order] == ["chat", "chat", "bulk", "bulk", "bulk"]
+    stats = scheduler.stats()["classes"]
+    assert stats["interactive"]["admitted"] == 2
+    assert stats["bulk"]["max_wait_seconds"] >= stats["interactive"]["max_wait_seconds"]
+
+
+def test_full_class_is_rejected_with_retry_after():
+    scheduler = ModelCallScheduler(requests_per_minute=60, max_queue_size=2)
+    scheduler.reserve(INTERACTIVE)
+    scheduler.reserve(INTERACTIVE)
+
+    with pytest.raises(SchedulerOverloaded) as excinfo:
+        scheduler.reserve(INTERACTIVE)
+    assert int(retry_after_header(excinfo.value)["Retry-After"]) >= 1
+
+    # Other classes have their own bound
+    scheduler.reserve(BULK)
+    stats = scheduler.stats()["classes"]
+    assert stats["interactive"]["rejected"] == 1
+    assert stats["interactive"]["in_flight_requests"] == 2
+
+
+def test_run_admitted_rejects_on_the_event_loop_without_taking_a_thread():
+    scheduler = ModelCallScheduler(max_queue_size=1)
+    release = threading.Event()
+
+    async def main():
+        first = asyncio.ensure_future(scheduler.run_admitted(INTERACTIVE, release.wait, 5))
+        await asyncio.sleep(0.05)
+        with pytest.raises(SchedulerOverloaded):
+            await scheduler.run_admitted(INTERACTIVE, lambda: None)
+        release.set()
+        return await first
+
+    assert asyncio.run(main()) is True
+    assert scheduler.stats()["classes"]["interactive"]["in_flight_requests"] == 0
+
+
+def test_rate_limited_calls_are_retried_with_backoff():
+    provider = FakeProvider(limit=2, window=0.2)
+    # The scheduler allows far more than the provider, so the provider pushes back
+    scheduler = ModelCallScheduler(requests_per_minute=60_000, max_retries=10, backoff_base=0.05, backoff_max=0.2)
+
+    results = [scheduler.submit(INTERACTIVE, lambda i=i: provider.call(i)) for i in range(6)]
+
+    assert results == list(range(6))
+    assert provider.rejected > 0
+    assert scheduler.stats()["classes"]["interactive"]["retries"] == provider.rejected
+
+
+def test_matching_rate_limit_avoids_provider_rejections():
+    provider = FakeProvider(limit=3, window=1.0)
+    scheduler = ModelCallScheduler(requests_per_minute=120, max_retries=0)
+    scheduler.request_bucket.tokens = 1
+
+    # Six back-to-back calls would trip the provider; paced at 2/s they never do
+    for i in range(6):
+        scheduler.submit(BULK, lambda i=i: provider.call(i))
+
+    assert provider.rejected == 0
+
+
+def test_retries_give_up_after_max_retries():
+    provider = FakeProvider(limit=0, window=1.0)
+    scheduler = ModelCallScheduler(max_retries=2, backoff_base=0.01)
+
+    with pytest.raises(openai.RateLimitError):
+        scheduler.submit(INTERACTIVE, provider.call)
+    assert provider.rejected == 3
+
+
+def test_workers_sharing_a_state_file_draw_on_one_budget(tmp_path):
+    state_path = str(tmp_path / "model_rate_limits.db")
+    # One scheduler per worker process; 60 RPM is a burst of 60 and then one per second
+    workers = [ModelCallScheduler(requests_per_minute=60, state_path=state_path) for _ in range(2)]
+    for worker in workers:
+        for i in range(30):
+            worker.submit(INTERACTIVE, lambda: None)
+
+    # Each worker has used only half of its configured rate, but together they spent the minute
+    started = time.monotonic()
+    workers[1].submit(INTERACTIVE, lambda: None)
+    assert time.monotonic() - started >= 0.5
+
+    # A worker with its own budget would not have waited
+    started = time.monotonic()
+    ModelCallScheduler(requests_per_minute=60).submit(INTERACTIVE, lambda: None)
+    assert time.monotonic() - started < 0.5